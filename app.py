@@ -1,8 +1,14 @@
 # -----------------------------------------------------------
 # Tech Trend Dashboard (Supabase → Streamlit)
 # -----------------------------------------------------------
+import hashlib
+import html
 import os
-from urllib.parse import quote_plus
+import socket
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import quote_plus, urlsplit
 from datetime import datetime
 import pandas as pd
 import streamlit as st
@@ -38,141 +44,283 @@ else:
     DB_PASSWORD = quote_plus(DB_PASSWORD_RAW)  # URL-encode password only
     PGURL = f"postgresql+psycopg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{int(DB_PORT)}/{DB_NAME}?sslmode={DB_SSLMODE}"
 
-# Create engine
-engine = create_engine(PGURL, pool_pre_ping=True)
-
-# ---------- 2) TEMP: visibility + connection debug (remove when green) ----------
-with st.expander("🔧 Secrets & DB connection debug (temporary)", expanded=False):
-    st.write("st.secrets keys:", list(getattr(st, "secrets", {}).keys()))
-    st.write("DB_HOST:", DB_HOST, "DB_PORT:", DB_PORT, "DB_NAME:", DB_NAME, "DB_USER:", DB_USER, "SSL:", DB_SSLMODE)
-    st.write("Using PGURL_VIEW (single URL):", bool(PGURL_DIRECT))
-    # DNS + raw connect
-    import socket, psycopg
-    # Parse host from DB_HOST or PGURL
-    host_for_dns = DB_HOST
-    if not host_for_dns and PGURL_DIRECT:
-        try:
-            from urllib.parse import urlsplit
-            sp = urlsplit(PGURL_DIRECT.replace("postgresql+psycopg", "postgresql"))
-            host_for_dns = (sp.hostname or "").strip()
-        except Exception:
-            host_for_dns = ""
+# Create engine once per process; reruns and sessions share the pool
+@st.cache_resource
+def get_engine():
+    return create_engine(PGURL, pool_pre_ping=True, pool_size=5, max_overflow=5, pool_recycle=1800)
+
+engine = get_engine()
+
+# ---------- 2) Connection debug (opt-in: APP_DEBUG=1 secret/env) ----------
+APP_DEBUG = _get_secret("APP_DEBUG") == "1"
+
+# Probes are cached for an hour so an open debug panel doesn't re-resolve/re-connect per rerun
+@st.cache_data(ttl=3600)
+def _probe_dns(host: str) -> str:
+    try:
+        socket.gethostbyname(host)
+        return ""
+    except Exception as e:
+        return repr(e)
+
+@st.cache_data(ttl=3600)
+def _probe_connect() -> str:
+    # Borrow a pooled connection: no extra TCP/TLS handshake, still surfaces auth/SSL errors
     try:
+        with engine.connect() as cx:
+            cx.execute(sql_text("select 1"))
+        return ""
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+if APP_DEBUG:
+    with st.expander("🔧 Secrets & DB connection debug", expanded=False):
+        st.write("st.secrets keys:", list(getattr(st, "secrets", {}).keys()))
+        st.write("DB_HOST:", DB_HOST, "DB_PORT:", DB_PORT, "DB_NAME:", DB_NAME, "DB_USER:", DB_USER, "SSL:", DB_SSLMODE)
+        st.write("Using PGURL_VIEW (single URL):", bool(PGURL_DIRECT))
+        # Parse host from DB_HOST or PGURL
+        host_for_dns = DB_HOST
+        if not host_for_dns and PGURL_DIRECT:
+            try:
+                sp = urlsplit(PGURL_DIRECT.replace("postgresql+psycopg", "postgresql"))
+                host_for_dns = (sp.hostname or "").strip()
+            except Exception:
+                host_for_dns = ""
         if host_for_dns:
-            socket.gethostbyname(host_for_dns)
-            st.success(f"DNS OK for {host_for_dns}")
+            err = _probe_dns(host_for_dns)
+            if err:
+                st.error(f"DNS failed: {err}")
+            else:
+                st.success(f"DNS OK for {host_for_dns}")
         else:
             st.info("No host parsed for DNS test.")
-    except Exception as e:
-        st.error(f"DNS failed: {e!r}")
-
 
+        # --- Pooled connection test ---
+        err = _probe_connect()
+        if err:
+            st.error(f"❌ engine.connect() failed: {err}")
+        else:
+            st.success("✅ engine.connect(): SUCCESS")
 
-    # --- Raw psycopg connection test ---
-try:
-    # psycopg expects 'postgresql://' not 'postgresql+psycopg://'
-    dsn_for_psycopg = PGURL.replace("postgresql+psycopg://", "postgresql://", 1)
-    import psycopg
-    psycopg.connect(dsn_for_psycopg, connect_timeout=5).close()
-    st.success("✅ psycopg.connect(): SUCCESS")
-except Exception as e:
-    st.error(f"❌ psycopg.connect() failed: {type(e).__name__}: {e}")
-    
 # ---------- 3) Query helper ----------
+def _fetch(sql: str, params: dict) -> pd.DataFrame:
+    # Buffered fetch: every query here returns a single JSON row or the short source list,
+    # so a server-side cursor would only add DECLARE/FETCH/CLOSE round trips
+    with engine.connect() as cx:
+        res = cx.execute(sql_text(sql), params)
+        return pd.DataFrame(res.fetchall(), columns=list(res.keys()))
+
 @st.cache_data(ttl=300)
 def q(sql: str, **params) -> pd.DataFrame:
-    with engine.begin() as cx:
-        return pd.read_sql(sql_text(sql), cx, params=params)
+    return _fetch(sql, params)
+
+# Disk copy of read-only results so a cold process start within the TTL skips the DB.
+# (st.cache_data(persist="disk") ignores ttl, which would pin stale data across restarts.)
+CACHE_DIR = Path(".cache")
+CACHE_MAX_ENTRIES = 64
+
+def _prune_disk_cache(ttl: int):
+    # Drop expired entries (and temp files left by a crashed write), then cap the count
+    now = time.time()
+    entries = []
+    for p in list(CACHE_DIR.glob("q_*.pkl")) + list(CACHE_DIR.glob("q_*.tmp")):
+        try:
+            mtime = p.stat().st_mtime
+            if now - mtime >= ttl:
+                p.unlink()
+            elif p.suffix == ".pkl":
+                entries.append((mtime, p))
+        except OSError:
+            pass
+    entries.sort(reverse=True)
+    for _, p in entries[CACHE_MAX_ENTRIES:]:
+        try:
+            p.unlink()
+        except OSError:
+            pass
+
+def _fetch_persisted(sql: str, params: dict, ttl: int) -> pd.DataFrame:
+    key = hashlib.sha1(repr((sql, sorted(params.items()))).encode()).hexdigest()
+    path = CACHE_DIR / f"q_{key}.pkl"
+    try:
+        if time.time() - path.stat().st_mtime < ttl:
+            return pd.read_pickle(path)
+    except Exception:
+        pass  # missing, stale or unreadable (truncated, other pandas version): refetch
+    df = _fetch(sql, params)
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        # Write to a unique temp file and rename, so readers never see a partial pickle
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, prefix=f"q_{key}.", suffix=".tmp")
+        os.close(fd)
+        try:
+            df.to_pickle(tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        _prune_disk_cache(ttl)
+    except OSError:
+        pass  # read-only filesystem: fall back to the in-memory cache alone
+    return df
+
+# Read-only results: cache_resource hands back the cached object itself, skipping the
+# pickle copy cache_data makes on every hit. Callers must not mutate the returned frame.
+# The memory entry can be filled from a disk entry that is already nearly expired, so
+# each layer gets half of the 5-minute budget to keep results at most 300s old.
+@st.cache_resource(ttl=150)
+def q_ro(sql: str, **params) -> pd.DataFrame:
+    return _fetch_persisted(sql, params, ttl=150)
+
+# Source list is near-static; refresh it hourly instead of on every rerun
+@st.cache_data(ttl=3600)
+def get_sources() -> list[str]:
+    return q("select distinct source from items order by 1")["source"].tolist()
 
 # ---------- 4) UI ----------
 st.title("Daily Tech Trends")
 st.caption("Interactive view on your Supabase dataset")
 
-# Controls
-c1, c2, c3 = st.columns([1, 1, 2])
-with c1:
-    days = st.selectbox("Window (days)", [1, 7, 14, 30], index=1)
-with c2:
-    src_df = q("select distinct source from items order by 1")
-    sources = src_df["source"].tolist()
-    sel_src = st.multiselect("Sources", options=sources, default=sources)
-with c3:
-    qtext = st.text_input("Search in title/body (optional)")
-
-where = ["ts >= now() - interval :days"]
+# Controls (in a form so edits/keystrokes don't rerun the queries until "Apply")
+sources = get_sources()
+with st.form("filters", clear_on_submit=False):
+    c1, c2, c3 = st.columns([1, 1, 2])
+    with c1:
+        days = st.selectbox("Window (days)", [1, 7, 14, 30], index=1)
+    with c2:
+        sel_src = st.multiselect("Sources", options=sources, default=sources)
+    with c3:
+        qtext = st.text_input("Search in title/body (optional)")
+    st.form_submit_button("Apply")
+
+# Same hour-aligned lower bound as the rollup, so totals don't shift when search is toggled
+where = ["ts >= date_trunc('hour', now() - interval :days)"]
+rollup_where = ["hour >= date_trunc('hour', now() - interval :days)"]
 params = {"days": f"{days} day"}
-if sel_src and len(sel_src) != len(sources):
-    where.append("source = ANY(:src)")
-    params["src"] = sel_src
+# Pass whichever of the selected set / its complement is smaller (nothing if all selected)
+missing = [s for s in sources if s not in sel_src]
+if sel_src and missing:
+    if len(missing) <= len(sel_src):
+        src_pred = "source <> ALL(:not_src)"
+        params["not_src"] = missing
+    else:
+        src_pred = "source = ANY(:src)"
+        params["src"] = sel_src
+    where.append(src_pred)
+    rollup_where.append(src_pred)
 if qtext:
-    where.append("(lower(title) like :q or lower(body) like :q)")
+    where.append("(title_lc like :q or body_lc like :q)")
     params["q"] = f"%{qtext.lower()}%"
 
 sql_where = " AND ".join(where)
 
+# Counts for KPIs/by-source/by-day: pre-aggregated hourly rollup unless a text search
+# is active (the rollup can't filter on title/body), in which case aggregate raw rows.
+if qtext:
+    agg_sql = """
+  select ts, source, 1 as n, (trend_score is not null)::int as n_scored,
+         trend_score::double precision as sum_score
+  from filtered"""
+else:
+    agg_sql = f"""
+  select hour as ts, source, n, n_scored, sum_score
+  from items_rollup_hourly
+  where {" AND ".join(rollup_where)}"""
+
+# One round trip: KPIs, top items, by-source and by-day all come from a single query
+dash = q_ro(f"""
+with filtered as (
+  select ts, source, title, url, trend_score
+  from items_30d
+  where {sql_where}
+),
+agg as ({agg_sql}
+)
+select json_build_object(
+  'kpi', (
+    select json_build_object(
+      'n_items', coalesce(sum(n), 0)::int,
+      'avg_score', round((sum(sum_score) / nullif(sum(n_scored), 0))::numeric,3)
+    )
+    from agg
+  ),
+  'top', coalesce((
+    select json_agg(t order by t.trend_score desc)
+    from (
+      select ts, source, title, url, trend_score
+      from filtered
+      order by trend_score desc
+      limit 100
+    ) t
+  ), '[]'::json),
+  'by_src', coalesce((
+    select json_agg(s order by s.n desc)
+    from (
+      select source, sum(n)::int as n
+      from agg
+      group by 1
+    ) s
+  ), '[]'::json),
+  'by_day', coalesce((
+    select json_agg(d order by d.day)
+    from (
+      select date_trunc('day', ts) as day, sum(n)::int as n
+      from agg
+      group by 1
+    ) d
+  ), '[]'::json)
+) as dash
+""", **params).iloc[0, 0]
+
+# Arrow-backed columns: compact strings and zero-copy handoff to Streamlit's Arrow serializer
+kpi = dash["kpi"]
+top = pd.DataFrame(dash["top"], columns=["ts", "source", "title", "url", "trend_score"])
+top["ts"] = pd.to_datetime(top["ts"], format="ISO8601", utc=True)
+top = top.convert_dtypes(dtype_backend="pyarrow")
+by_src = pd.DataFrame(dash["by_src"], columns=["source", "n"]).convert_dtypes(dtype_backend="pyarrow")
+by_day = pd.DataFrame(dash["by_day"], columns=["day", "n"])
+by_day["day"] = pd.to_datetime(by_day["day"], format="ISO8601", utc=True)
+by_day = by_day.convert_dtypes(dtype_backend="pyarrow")
+
 # KPIs
-kpi = q(f"""
-select
-  count(*)::int as n_items,
-  round(avg(trend_score)::numeric,3) as avg_score
-from items
-where {sql_where}
-""", **params)
 k1, k2, k3 = st.columns(3)
-k1.metric("Items", int(kpi["n_items"][0] or 0))
-k2.metric("Avg trend score", float(kpi["avg_score"][0] or 0))
+k1.metric("Items", int(kpi["n_items"] or 0))
+k2.metric("Avg trend score", float(kpi["avg_score"] or 0))
 k3.metric("Last refresh (UTC)", datetime.utcnow().strftime("%Y-%m-%d %H:%M"))
 
-# Top items table
-st.subheader("Top items")
-top = q(f"""
-select ts, source, title, url, trend_score
-from items
-where {sql_where}
-order by trend_score desc
-limit 100
-""", **params)
-
-if not top.empty:
-    top = top.assign(TitleLink=top.apply(lambda r: f"[{r['title']}]({r['url']})", axis=1))
-    top_display = top[["ts", "source", "TitleLink", "trend_score"]].rename(
-        columns={"ts": "Time (UTC)", "source": "Source", "TitleLink": "Title", "trend_score": "Trend score"}
-    )
-    st.dataframe(
-        top_display,
-        use_container_width=True,
-        column_config={"Title": st.column_config.LinkColumn("Title")},
-        hide_index=True
-    )
-else:
-    st.info("No items match your filters.")
-
-# Volume by source
-st.subheader("Volume by source")
-by_src = q(f"""
-select source, count(*)::int as n
-from items
-where {sql_where}
-group by 1
-order by n desc
-""", **params)
-if not by_src.empty:
-    st.bar_chart(by_src.set_index("source"))
-else:
-    st.info("No data for selected window/sources.")
-
-# Daily volume
-st.subheader(f"Daily volume (last {days}d)")
-by_day = q(f"""
-select date_trunc('day', ts) as day, count(*)::int as n
-from items
-where {sql_where}
-group by 1
-order by 1
-""", **params)
-if not by_day.empty:
-    by_day = by_day.rename(columns={"day": "date"}).set_index("date")
-    st.line_chart(by_day["n"])
-else:
-    st.info("No daily data.")
+# Panes: st.tabs would execute and ship every pane on each rerun, so a radio picks
+# the one pane to build; switching panes reruns against the cached query.
+view = st.radio("View", ["Top items", "By source", "Daily"], horizontal=True, label_visibility="collapsed")
+
+if view == "Top items":
+    st.subheader("Top items")
+    if not top.empty:
+        # Static HTML table: 100 read-only rows don't need the interactive grid.
+        # Titles/URLs come from scraped data, so escape them before emitting raw HTML.
+        url = top["url"].fillna("").astype(str)
+        url = url.where(url.str.match(r"https?://"), "")
+        top_display = pd.DataFrame({
+            "Time (UTC)": top["ts"].dt.strftime("%Y-%m-%d %H:%M"),
+            "Source": top["source"].fillna("").astype(str).map(html.escape),
+            "Title": '<a href="' + url.map(html.escape) + '" target="_blank">'
+                     + top["title"].fillna("").astype(str).map(html.escape) + "</a>",
+            "Trend score": top["trend_score"].round(3),
+        })
+        st.markdown(top_display.to_html(index=False, escape=False), unsafe_allow_html=True)
+    else:
+        st.info("No items match your filters.")
 
+elif view == "By source":
+    st.subheader("Volume by source")
+    if not by_src.empty:
+        st.bar_chart(by_src.set_index("source"))
+    else:
+        st.info("No data for selected window/sources.")
+
+else:
+    st.subheader(f"Daily volume (last {days}d)")
+    if not by_day.empty:
+        by_day = by_day.rename(columns={"day": "date"}).set_index("date")
+        st.line_chart(by_day["n"])
+    else:
+        st.info("No daily data.")
@@ -1,69 +1,110 @@
-import os, io, base64
+import os, io, base64, threading
 from datetime import datetime, timezone
-import pandas as pd
-import matplotlib.pyplot as plt
-from sqlalchemy import create_engine, text
-from reportlab.lib.pagesizes import LETTER
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table
-from reportlab.lib.units import inch
-import requests
+from pathlib import Path
+from psycopg_pool import ConnectionPool
 
 # --- DB connection ---
 PGURL = os.environ.get("PGURL_VIEW") or os.environ.get("PGURL")
 if not PGURL:
     raise SystemExit("PGURL_VIEW/PGURL not set")
-if "postgresql+psycopg" not in PGURL:
-    PGURL = PGURL.replace("postgresql://", "postgresql+psycopg://")
-engine = create_engine(PGURL, pool_pre_ping=True)
-
-def fetch_df(sql: str, **params):
-    with engine.begin() as cx:
-        return pd.read_sql(text(sql), cx, params=params)
-
-# last 7 days
-by_day = fetch_df("""
-select date_trunc('day', ts) as day, count(*)::int as n
-from items
-where ts >= now() - interval '7 days'
-group by 1 order by 1;
-""")
-by_src = fetch_df("""
-select source, count(*)::int as n
-from items
-where ts >= now() - interval '7 days'
-group by 1 order by n desc
-limit 10;
-""")
-top = fetch_df("""
-select ts, source, title, url, trend_score
-from items
-where ts >= now() - interval '7 days'
-order by trend_score desc
-limit 20;
-""")
+# psycopg expects 'postgresql://' not 'postgresql+psycopg://'
+PGURL = PGURL.replace("postgresql+psycopg://", "postgresql://", 1)
+pool = ConnectionPool(PGURL, min_size=1, max_size=2, kwargs={"autocommit": True}, open=True)
+
+def fetch(sql: str, **params):
+    # Plain row tuples: results are a few dozen rows, not worth a DataFrame
+    with pool.connection() as cx:
+        return cx.execute(sql, params or None).fetchall()
+
+# last 7 days in one round trip: by_day and by_src share one scan of the window (the
+# recent CTE); top is a separate index-ordered read of items
+report = fetch("""
+with recent as (
+  select ts, source
+  from items
+  where ts >= now() - interval '7 days'
+)
+select json_build_object(
+  'by_day', coalesce((
+    select json_agg(d order by d.day)
+    from (
+      select date_trunc('day', ts) as day, count(*)::int as n
+      from recent
+      group by 1
+    ) d
+  ), '[]'::json),
+  'by_src', coalesce((
+    select json_agg(s order by s.n desc)
+    from (
+      select source, count(*)::int as n
+      from recent
+      group by 1 order by n desc
+      limit 10
+    ) s
+  ), '[]'::json),
+  'top', coalesce((
+    select json_agg(t order by t.trend_score desc)
+    from (
+      -- straight from items (not the materialized CTE) so items_score_ts can serve the top-N;
+      -- display strings are formatted here so the table needs no per-cell Python formatting
+      select to_char(ts at time zone 'UTC', 'YYYY-MM-DD HH24:MI') as ts_fmt,
+             source, title, url, trend_score,
+             round(trend_score::numeric, 3)::text as score_fmt
+      from items
+      where ts >= now() - interval '7 days'
+      order by trend_score desc
+      limit 20
+    ) t
+  ), '[]'::json)
+) as report;
+""")[0][0]
+pool.close()
+by_day, by_src, top = report["by_day"], report["by_src"], report["top"]
+if not by_day:
+    print("[report] no items in the last 7 days; nothing to report")
+    raise SystemExit(0)
+
+# Charting/PDF imports are deferred until we know there is something to render
+import numpy as np
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from reportlab.lib.pagesizes import LETTER
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table
+from reportlab.lib.units import inch
+
+# Pin the bundled font so text layout resolves straight to it instead of walking the family list
+matplotlib.rcParams["font.family"] = "DejaVu Sans"
 
 def fig_to_png_bytes(make_plot):
-    fig = plt.figure(figsize=(7,3.2), dpi=150)
-    try:
-        make_plot(fig)
-        buf = io.BytesIO()
-        fig.savefig(buf, format="png", bbox_inches="tight")
-        buf.seek(0)
-        return buf
-    finally:
-        plt.close(fig)
+    # Figure + Agg canvas directly: no pyplot global state, no GUI backend
+    fig = Figure(figsize=(7,3.2), dpi=150)
+    FigureCanvasAgg(fig)  # attaches itself as fig.canvas
+    ax = fig.add_subplot(111)
+    make_plot(fig, ax)
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    buf.seek(0)
+    return buf
 
-daily_png = fig_to_png_bytes(lambda fig: (
-    plt.plot(by_day["day"], by_day["n"]),
-    plt.title("Daily volume (7 days)"),
-    plt.xlabel("Day"), plt.ylabel("# Items")
+# Plain NumPy inputs: datetime64 skips matplotlib's per-element date conversion
+# (day buckets are ISO strings in the session time zone; the date part is the bucket)
+days = np.array([d["day"][:10] for d in by_day], dtype="datetime64[D]")
+day_counts = np.array([d["n"] for d in by_day])
+src_names = [s["source"] for s in by_src]
+src_counts = np.array([s["n"] for s in by_src])
+
+daily_png = fig_to_png_bytes(lambda fig, ax: (
+    ax.plot(days, day_counts),
+    ax.set_title("Daily volume (7 days)"),
+    ax.set_xlabel("Day"), ax.set_ylabel("# Items")
 ))
-src_png = fig_to_png_bytes(lambda fig: (
-    plt.bar(by_src["source"], by_src["n"]),
-    plt.title("Top sources (7 days)"),
-    plt.xticks(rotation=45, ha="right"),
-    plt.xlabel("Source"), plt.ylabel("# Items")
+src_png = fig_to_png_bytes(lambda fig, ax: (
+    ax.bar(src_names, src_counts),
+    ax.set_title("Top sources (7 days)"),
+    ax.set_xticks(range(len(src_names)), src_names, rotation=45, ha="right"),
+    ax.set_xlabel("Source"), ax.set_ylabel("# Items")
 ))
 
 today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
@@ -86,21 +127,37 @@ story.append(Paragraph("Top sources", styles["Heading3"]))
 story.append(Image(src_png, width=6.5*inch, height=3.0*inch))
 story.append(Spacer(1, 0.2*inch))
 story.append(Paragraph("Top items (by trend score)", styles["Heading3"]))
-table_data = [["Time (UTC)","Source","Title","Score"]]
-for _, r in top.iterrows():
-    table_data.append([str(r["ts"])[:16], r["source"], r["title"], f'{r["trend_score"]:.3f}'])
+table_data = [["Time (UTC)","Source","Title","Score"]] + [
+    [r["ts_fmt"], r["source"], r["title"], r["score_fmt"]] for r in top
+]
 story.append(Table(table_data, colWidths=[1.5*inch, 1.0*inch, 3.5*inch, 0.5*inch]))
-doc = SimpleDocTemplate(pdf_path, pagesize=LETTER, leftMargin=0.6*inch, rightMargin=0.6*inch)
+pdf_buf = io.BytesIO()
+doc = SimpleDocTemplate(pdf_buf, pagesize=LETTER, leftMargin=0.6*inch, rightMargin=0.6*inch)
 doc.build(story)
-print(f"[report] wrote {pdf_path}")
+pdf_bytes = pdf_buf.getbuffer()  # view of the buffer: no copy for the file write or base64
 
 # Email via SendGrid (optional)
 SG_KEY = os.environ.get("SENDGRID_API_KEY")
 TO_EMAIL = os.environ.get("REPORT_TO_EMAIL")
 FROM_EMAIL = os.environ.get("REPORT_FROM_EMAIL")
-if SG_KEY and TO_EMAIL and FROM_EMAIL:
-    with open(pdf_path, "rb") as f:
-        pdf_b64 = base64.b64encode(f.read()).decode("ascii")
+
+email_errors = []  # filled by the sender thread; checked after join to fail the run
+
+# Send budget: per-attempt (connect, read) timeouts plus retry backoff must fit inside the
+# join below, so the daemon thread is never killed mid-send.
+SEND_CONNECT_TIMEOUT, SEND_READ_TIMEOUT = 5, 15
+SEND_RETRIES, SEND_BACKOFF = 2, 1
+SEND_DEADLINE = (
+    (SEND_RETRIES + 1) * (SEND_CONNECT_TIMEOUT + SEND_READ_TIMEOUT)
+    + SEND_BACKOFF * 2 ** SEND_RETRIES  # upper bound on urllib3's exponential backoff sleeps
+    + 5  # slack for payload encoding
+)
+
+def send_sendgrid(pdf_bytes: memoryview):
+    import orjson, requests  # only needed when email is configured
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    pdf_b64 = base64.b64encode(pdf_bytes).decode("ascii")
     payload = {
       "personalizations": [{"to": [{"email": TO_EMAIL}]}],
       "from": {"email": FROM_EMAIL, "name": "Trend Reports"},
@@ -113,11 +170,43 @@ if SG_KEY and TO_EMAIL and FROM_EMAIL:
           "disposition": "attachment"
       }]
     }
-    r = requests.post(
-        "https://api.sendgrid.com/v3/mail/send",
-        headers={"Authorization": f"Bearer {SG_KEY}", "Content-Type": "application/json"},
-        json=payload, timeout=20
-    )
-    print("[email] status:", r.status_code, r.text[:200])
+    # One keep-alive connection reused across retries. mail/send is not idempotent, so only
+    # retry when the message was certainly not accepted: connection failures and 429
+    # (throttled). Gateway errors and read timeouts may follow a delivered send; no retry.
+    # Retry-After is ignored so the total stays within SEND_DEADLINE.
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=Retry(
+        total=SEND_RETRIES, connect=SEND_RETRIES, status=SEND_RETRIES, read=0, other=0,
+        status_forcelist=(429,), allowed_methods=frozenset({"POST"}),
+        backoff_factor=SEND_BACKOFF, respect_retry_after_header=False, raise_on_status=False,
+    )))
+    try:
+        r = session.post(
+            "https://api.sendgrid.com/v3/mail/send",
+            headers={"Authorization": f"Bearer {SG_KEY}", "Content-Type": "application/json"},
+            data=orjson.dumps(payload), timeout=(SEND_CONNECT_TIMEOUT, SEND_READ_TIMEOUT)
+        )
+        print("[email] status:", r.status_code, r.text[:200])
+    except Exception as e:
+        print(f"[email] failed: {type(e).__name__}: {e}")
+        email_errors.append(e)
+    finally:
+        session.close()
+
+# Start the upload from the in-memory PDF right away; the disk write overlaps with it
+sender = None
+if SG_KEY and TO_EMAIL and FROM_EMAIL:
+    sender = threading.Thread(target=send_sendgrid, args=(pdf_bytes,), daemon=True)
+    sender.start()
 else:
     print("[email] skipped (missing SENDGRID_API_KEY or emails)")
+
+Path(pdf_path).write_bytes(pdf_bytes)
+print(f"[report] wrote {pdf_path}")
+
+if sender:
+    sender.join(timeout=SEND_DEADLINE)
+    if sender.is_alive():
+        raise SystemExit(f"[email] still sending after {SEND_DEADLINE}s; giving up")
+    if email_errors:
+        raise SystemExit(1)
@@ -0,0 +1,32 @@
+-- -----------------------------------------------------------
+-- Hot 30-day window read by the dashboard (app.py)
+-- Run once as the owner of `items`. The Window selector tops out at 30 days,
+-- so every dashboard query fits inside this view.
+-- -----------------------------------------------------------
+create extension if not exists pg_trgm;
+
+create materialized view if not exists items_30d as
+select
+  id, ts, source, title, url, trend_score,
+  lower(title) as title_lc,
+  lower(body)  as body_lc
+from items
+where ts >= now() - interval '30 day';
+
+-- REFRESH ... CONCURRENTLY needs a unique index (assumes items.id is the primary key)
+create unique index if not exists items_30d_id on items_30d (id);
+create index if not exists items_30d_ts on items_30d (ts);
+create index if not exists items_30d_source on items_30d (source);
+-- Trigram indexes serve the search box's `title_lc like '%…%' or body_lc like '%…%'`;
+-- with both indexed the planner can BitmapOr them instead of seq-scanning
+create index if not exists items_30d_title_trgm on items_30d using gin (title_lc gin_trgm_ops);
+create index if not exists items_30d_body_trgm on items_30d using gin (body_lc gin_trgm_ops);
+
+grant select on items_30d to analytics_ro;
+
+-- Refresh every 5 minutes (matches the app's query cache TTL); requires pg_cron
+select cron.schedule(
+  'refresh-items-30d',
+  '*/5 * * * *',
+  'refresh materialized view concurrently items_30d'
+);
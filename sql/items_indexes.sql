@@ -0,0 +1,9 @@
+-- -----------------------------------------------------------
+-- Indexes on `items` used by the weekly report (make_weekly_report.py)
+-- Run once as the owner of `items`.
+-- -----------------------------------------------------------
+
+-- Top items by score: lets `where ts >= now() - interval '7 days'
+-- order by trend_score desc limit 20` walk the index and stop after 20 matches
+-- (Limit -> Index Scan) instead of sorting the whole week.
+create index if not exists items_score_ts on items (trend_score desc, ts desc);
@@ -0,0 +1,44 @@
+-- -----------------------------------------------------------
+-- Hourly (hour, source) rollup behind the dashboard KPIs and volume charts (app.py)
+-- Run once as the owner of `items`, after sql/items_30d.sql. The rollup is rebuilt
+-- from items_30d in the same pg_cron job that refreshes the view, so it always
+-- reflects exactly the rows the top-100 and the search path read: late-arriving
+-- ts values, score updates, deletes and rows ageing out of the window included.
+-- -----------------------------------------------------------
+create table if not exists items_rollup_hourly (
+  hour      timestamptz      not null,
+  source    text,                       -- NULL kept as its own group, like the raw-row path
+  n         int              not null,  -- items in the hour
+  n_scored  int              not null,  -- items with a non-null trend_score
+  sum_score double precision not null
+);
+create index if not exists items_rollup_hourly_hour on items_rollup_hourly (hour);
+
+-- Upgrade from the incremental version: drop its key/NOT NULL, function and cron job
+alter table items_rollup_hourly drop constraint if exists items_rollup_hourly_pkey;
+alter table items_rollup_hourly alter column source drop not null;
+drop function if exists refresh_items_rollup_hourly(timestamptz);
+select cron.unschedule(jobid) from cron.job where jobname = 'refresh-items-rollup-hourly';
+
+-- Full rebuild in one transaction (DELETE rather than TRUNCATE so readers keep seeing
+-- the previous contents until commit). ~30 days x 24 hours x sources rows.
+create or replace function refresh_items_rollup_hourly()
+returns void language sql as $$
+  delete from items_rollup_hourly;
+  insert into items_rollup_hourly (hour, source, n, n_scored, sum_score)
+  select date_trunc('hour', ts), source, count(*), count(trend_score),
+         coalesce(sum(trend_score), 0)
+  from items_30d
+  group by 1, 2;
+$$;
+
+select refresh_items_rollup_hourly();
+
+grant select on items_rollup_hourly to analytics_ro;
+
+-- Replace the items_30d refresh job so the view and the rollup move together
+select cron.schedule(
+  'refresh-items-30d',
+  '*/5 * * * *',
+  $$refresh materialized view concurrently items_30d; select refresh_items_rollup_hourly()$$
+);